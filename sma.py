@@ -1,11 +1,146 @@
 import sys
 sys.path.append('../..')  # Add backtesting directory for util.py
+import os
+import numpy as np
 import pandas as pd
-from util import load_kline
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from util import load_kline, kline_dir, kline_cache_file, normalize_time, compact_dtypes, write_cache_file
+
+try:
+    import numba
+except ImportError:  # numba is optional, fall back to pandas rolling
+    numba = None
+
+
+SMA_WINDOWS = (7, 25, 99)
+MA_COLUMNS = [f'ma{window}' for window in SMA_WINDOWS]
+
+
+if numba is not None:
+    # nogil so load_ticker_set_sma can run one symbol per thread
+    @numba.njit(cache=True, nogil=True)
+    def _rolling_means_numba(close, windows, out):
+        # Running sum and count of non-NaN values per window: add the new value,
+        # subtract the one leaving the window (NaN is skipped like pandas does)
+        for row in range(len(windows)):
+            window = windows[row]
+            total = 0.0
+            count = 0
+            for i in range(len(close)):
+                value = close[i]
+                if not np.isnan(value):
+                    total += value
+                    count += 1
+                if i >= window:
+                    old = close[i - window]
+                    if not np.isnan(old):
+                        total -= old
+                        count -= 1
+                if count > 0:
+                    out[row, i] = total / count
+                else:
+                    total = 0.0  # drop rounding residue once the window is all NaN
+                    out[row, i] = np.nan
+
+
+def _rolling_means_pandas(close, windows, out):
+    # Per-window rolling re-bases its sums, unlike a global cumsum that loses precision on long series
+    series = pd.Series(close)
+    for row, window in enumerate(windows):
+        out[row] = series.rolling(window, min_periods=1).mean().to_numpy()
+
+
+def rolling_means(close: np.ndarray, windows: tuple = SMA_WINDOWS) -> np.ndarray:
+    """
+    Compute trailing simple moving averages for every window in a single pass.
+
+    Equivalent to rolling(window, min_periods=1).mean() on one symbol's Close series.
+    Uses a numba running-sum kernel when numba is installed, otherwise pandas rolling per window.
+    NaN values are skipped; a window with no valid value gives NaN.
+
+    Args:
+        close: Close prices of one symbol, in time order
+        windows: Window lengths (default: 7, 25, 99)
+
+    Returns:
+        float64 array of shape (len(windows), len(close)), one row per window
+    """
+    out = np.empty((len(windows), len(close)), dtype=np.float64)
+
+    if numba is not None:
+        _rolling_means_numba(np.ascontiguousarray(close, dtype=np.float64),
+                             np.asarray(windows, dtype=np.int64), out)
+    else:
+        _rolling_means_pandas(np.asarray(close, dtype=np.float64), windows, out)
+
+    return out
+
+
+def sma_cache_file(kline_file: str) -> str:
+    """
+    Get the SMA cache path stored next to a kline cache file.
+
+    Pattern: {symbol}_{timeframe}-{years}.sma.parquet
+
+    Args:
+        kline_file: Kline cache file path (see util.kline_cache_file)
+
+    Returns:
+        SMA cache file path
+    """
+    return kline_file[:-len('.parquet')] + '.sma.parquet'
+
+
+def _read_sma_cache(kline_file: str, sma_file: str, length: int) -> Optional[np.ndarray]:
+    """
+    Read cached moving averages if they are newer than the kline cache and match its length.
+
+    Returns:
+        float64 array of shape (len(SMA_WINDOWS), length), or None on a miss
+    """
+    if not (os.path.exists(sma_file) and os.path.exists(kline_file)):
+        return None
+    if os.path.getmtime(sma_file) < os.path.getmtime(kline_file):
+        return None
+
+    sma_df = pd.read_parquet(sma_file, columns=MA_COLUMNS, memory_map=True)
+    if len(sma_df) != length:
+        return None
+    return sma_df.to_numpy(dtype=np.float64).T
+
+
+def _symbol_sma(symbol: str, symbol_df: pd.DataFrame, cache_dir: str, ticker: str,
+                years: Optional[list]) -> np.ndarray:
+    """
+    Get one symbol's moving averages from the SMA cache, or compute and cache them.
+
+    Returns:
+        float64 array of shape (len(SMA_WINDOWS), len(symbol_df))
+    """
+    kline_file = kline_cache_file(cache_dir, symbol, ticker, years)
+    sma_file = sma_cache_file(kline_file)
+
+    cached = _read_sma_cache(kline_file, sma_file, len(symbol_df))
+    if cached is not None:
+        print(f"SMA cache hit: {sma_file}")
+        return cached
+
+    mas = rolling_means(symbol_df['Close'].to_numpy())
+
+    # Save to cache
+    symbol_sma = pd.DataFrame({'symbol': symbol, 'time': symbol_df['time'].to_numpy()})
+    for row, name in enumerate(MA_COLUMNS):
+        symbol_sma[name] = mas[row]
+    write_cache_file(sma_file, lambda path: symbol_sma.to_parquet(path, index=False))
+    print(f"SMA cached: {sma_file}")
+
+    return mas
 
 
 def load_ticker_set_sma(source: str = "binance", market: str = "spot", market_sub: str = "um",
-                        ticker: str = "1m", years: list = None, symbols: list = None) -> pd.DataFrame:
+                        ticker: str = "1m", years: list = None, symbols: list = None,
+                        columns: list = None, use_polars: bool = False, dtypes: str = None) -> pd.DataFrame:
     """
     Load ticker data and add 7, 25, 99 period moving averages.
 
@@ -16,17 +151,60 @@ def load_ticker_set_sma(source: str = "binance", market: str = "spot", market_su
         ticker: Timeframe - 1m, 3m, 5m, 15m, 30m, 1h, 4h, 8h, 12h, 1d (default: "1m")
         years: List of years to load (e.g., [2024, 2025]). None loads all years.
         symbols: List of symbols to filter (e.g., ["BTCUSDT", "ETHUSDT"]). None loads all symbols.
+        columns: List of kline columns to load (e.g., ["Close"]). Close is always included.
+                 None loads all columns.
+        use_polars: Compute with the lazy Polars pipeline in sma_pl (requires polars).
+                    Reads source files directly and ignores columns and dtypes.
+        dtypes: "compact" returns float32 prices and moving averages and a categorical symbol
+                (see util.load_kline). Moving averages are always computed and cached from
+                float64 prices. None keeps float64.
 
     Returns:
         DataFrame with additional columns: ma7, ma25, ma99
+
+    Moving averages are cached per symbol next to the kline cache
+    ({symbol}_{timeframe}-{years}.sma.parquet) and recomputed when the kline cache is newer.
     """
-    df = load_kline(source=source, market=market, market_sub=market_sub,
-                    timeframe=ticker, years=years, symbols=symbols)
+    if dtypes not in (None, "compact"):
+        raise ValueError(f"Invalid dtypes '{dtypes}'. Valid options: None, 'compact'")
+
+    if use_polars:
+        from sma_pl import load_ticker_set_sma_pl
+        df = load_ticker_set_sma_pl(source=source, market=market, market_sub=market_sub,
+                                    ticker=ticker, years=years, symbols=symbols).to_pandas()
+        return normalize_time(df)
+
+    if columns is not None and 'Close' not in columns:
+        columns = list(columns) + ['Close']
+
+    # Load float64 prices so cached moving averages do not depend on dtypes
+    klines = load_kline(source=source, market=market, market_sub=market_sub, timeframe=ticker,
+                        years=years, symbols=symbols, columns=columns, return_format="dict")
+    cache_dir = os.path.join(kline_dir(source, market, market_sub), "_cache")
+
+    # Calculate moving averages symbol by symbol, each Close array is contiguous
+    def symbol_sma(item):
+        symbol, symbol_df = item
+        return _symbol_sma(symbol, symbol_df, cache_dir, ticker, years)
+
+    if numba is not None and len(klines) > 1:
+        # The numba kernel releases the GIL, so symbols run in parallel on all cores
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            all_mas = list(executor.map(symbol_sma, klines.items()))
+    else:
+        all_mas = [symbol_sma(item) for item in klines.items()]
+
+    for symbol_df, mas in zip(klines.values(), all_mas):
+        if dtypes == "compact":
+            mas = mas.astype(np.float32)
+            compact_dtypes(symbol_df)
+        for row, name in enumerate(MA_COLUMNS):
+            symbol_df[name] = mas[row]
 
-    # Calculate moving averages per symbol
-    df['ma7'] = df.groupby('symbol')['Close'].transform(lambda x: x.rolling(window=7, min_periods=1).mean())
-    df['ma25'] = df.groupby('symbol')['Close'].transform(lambda x: x.rolling(window=25, min_periods=1).mean())
-    df['ma99'] = df.groupby('symbol')['Close'].transform(lambda x: x.rolling(window=99, min_periods=1).mean())
+    df = pd.concat(list(klines.values()), ignore_index=True)
+    if dtypes == "compact":
+        # Per-symbol categories do not survive concat
+        df['symbol'] = df['symbol'].astype('category')
 
     return df
 
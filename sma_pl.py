@@ -0,0 +1,75 @@
+import sys
+sys.path.append('../..')  # Add backtesting directory for util.py
+import os
+import polars as pl
+from util import kline_dir, find_kline_files
+from sma import SMA_WINDOWS
+
+
+def add_sma_columns(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Sort by symbol, time and add per-symbol 7, 25, 99 period moving averages.
+
+    Equivalent to rolling(window, min_periods=1).mean() per symbol; NaN Close values
+    are treated as missing and skipped like pandas does.
+
+    Args:
+        lf: LazyFrame with symbol, time and Close columns
+
+    Returns:
+        LazyFrame with additional columns: ma7, ma25, ma99
+    """
+    # rolling_mean skips nulls but propagates NaN, so turn NaN into null first
+    close = pl.col('Close').fill_nan(None)
+    return lf.sort(['symbol', 'time']).with_columns([
+        close.rolling_mean(window, min_samples=1).over('symbol').alias(f'ma{window}')
+        for window in SMA_WINDOWS
+    ])
+
+
+def load_ticker_set_sma_pl(source: str = "binance", market: str = "spot", market_sub: str = "um",
+                           ticker: str = "1m", years: list = None, symbols: list = None) -> pl.DataFrame:
+    """
+    Load ticker data and add 7, 25, 99 period moving averages with a lazy Polars pipeline.
+
+    Reads the kline source files directly (no _cache), so the parquet scan, sort and
+    per-symbol rolling means are planned and executed as one streaming query.
+
+    Args:
+        source: Data source (default: "binance")
+        market: Market type - "spot" or "future" (default: "spot")
+        market_sub: Market subtype for futures - "um" or "cm" (default: "um")
+        ticker: Timeframe - 1m, 3m, 5m, 15m, 30m, 1h, 4h, 8h, 12h, 1d (default: "1m")
+        years: List of years to load (e.g., [2024, 2025]). None loads all years.
+        symbols: List of symbols to load (e.g., ["BTCUSDT", "ETHUSDT"]). Required.
+
+    Returns:
+        Polars DataFrame sorted by symbol, time with additional columns: ma7, ma25, ma99
+    """
+    if symbols is None or len(symbols) == 0:
+        raise ValueError("symbols parameter is required and cannot be empty")
+
+    dir_path = kline_dir(source, market, market_sub)
+    if not os.path.exists(dir_path):
+        raise FileNotFoundError(f"Directory not found: {dir_path}")
+
+    matching_files = []
+    for symbol in symbols:
+        matching_files.extend(find_kline_files(dir_path, symbol, ticker, years))
+
+    if not matching_files:
+        raise FileNotFoundError(f"No data found for symbols {symbols}")
+
+    lf = add_sma_columns(pl.scan_parquet(matching_files))
+    df = lf.collect(engine="streaming")
+    print(f"Loaded {len(matching_files)} files for {len(symbols)} symbols, shape: {df.shape}")
+
+    return df
+
+
+if __name__ == "__main__":
+    # Test the function
+    df = load_ticker_set_sma_pl(market="spot", ticker="1m", years=[2025], symbols=["FORMUSDT"])
+    print(df.head(20))
+    print(f"\nShape: {df.shape}")
+    print(f"\nColumns: {df.columns}")
@@ -20,6 +20,20 @@ def test_load_kline():
     return df
 
 
+def test_load_kline_dict():
+    """Test load_kline returning per-symbol DataFrames for SUIUSDT, year 2025"""
+    dfs = load_kline(
+        market="spot",
+        timeframe="1m",
+        years=[2025],
+        symbols=["SUIUSDT"],
+        return_format="dict"
+    )
+    for symbol, df in dfs.items():
+        print(f"load_kline {symbol} shape: {df.shape}")
+    return dfs
+
+
 def test_load_parquet():
     """Test load_parquet for SUIUSDT, year 2025"""
     df = load_parquet(
@@ -48,12 +62,32 @@ def test_load_ticker_set_sma():
     return df
 
 
+def test_load_ticker_set_sma_polars():
+    """Test load_ticker_set_sma with the Polars pipeline for SUIUSDT, year 2025"""
+    df = load_ticker_set_sma(
+        market="spot",
+        ticker="1m",
+        years=[2025],
+        symbols=["SUIUSDT"],
+        use_polars=True
+    )
+    print(f"load_ticker_set_sma (polars) shape: {df.shape}")
+    print(f"Columns: {df.columns.tolist()}")
+    print(df.head())
+    return df
+
+
 if __name__ == "__main__":
     print("=" * 50)
     print("Testing load_kline")
     print("=" * 50)
     test_load_kline()
 
+    print("\n" + "=" * 50)
+    print("Testing load_kline (dict)")
+    print("=" * 50)
+    test_load_kline_dict()
+
     print("\n" + "=" * 50)
     print("Testing load_parquet")
     print("=" * 50)
@@ -63,3 +97,8 @@ if __name__ == "__main__":
     print("Testing load_ticker_set_sma")
     print("=" * 50)
     test_load_ticker_set_sma()
+
+    print("\n" + "=" * 50)
+    print("Testing load_ticker_set_sma (polars)")
+    print("=" * 50)
+    test_load_ticker_set_sma_polars()
@@ -0,0 +1,80 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import sma
+from sma import MA_COLUMNS, SMA_WINDOWS, rolling_means
+
+
+def make_close_frame():
+    """In-memory klines: symbol lengths below 7, between 7 and 99, above 99, with NaN gaps"""
+    rng = np.random.default_rng(0)
+    dfs = []
+    for symbol, length in [("AAAUSDT", 5), ("BBBUSDT", 60), ("CCCUSDT", 250)]:
+        close = rng.random(length) * 100
+        if length > 7:
+            close[[2, 3]] = np.nan
+        if length > 200:
+            close[120:230] = np.nan  # gap longer than the largest window
+        dfs.append(pd.DataFrame({
+            "symbol": symbol,
+            "time": pd.date_range("2025-01-01", periods=length, freq="1min"),
+            "Close": close,
+        }))
+    return pd.concat(dfs, ignore_index=True)
+
+
+def expected_mas(df):
+    gb = df.groupby("symbol", sort=False)["Close"]
+    return {f"ma{window}": gb.rolling(window, min_periods=1).mean().reset_index(level=0, drop=True).to_numpy()
+            for window in SMA_WINDOWS}
+
+
+def check_rolling_means():
+    df = make_close_frame()
+    expected = expected_mas(df)
+    for _, symbol_df in df.groupby("symbol", sort=False):
+        mas = rolling_means(symbol_df["Close"].to_numpy())
+        for row, name in enumerate(MA_COLUMNS):
+            np.testing.assert_allclose(mas[row], expected[name][symbol_df.index], equal_nan=True)
+
+
+def test_rolling_means_numba():
+    """Test the numba kernel against pandas groupby rolling"""
+    pytest.importorskip("numba")
+    assert sma.numba is not None
+    check_rolling_means()
+
+
+def test_rolling_means_pandas():
+    """Test the pandas rolling fallback against pandas groupby rolling"""
+    numba = sma.numba
+    sma.numba = None
+    try:
+        check_rolling_means()
+    finally:
+        sma.numba = numba
+
+
+def test_add_sma_columns_polars():
+    """Test the Polars pipeline against pandas groupby rolling"""
+    pl = pytest.importorskip("polars")
+    from sma_pl import add_sma_columns
+
+    df = make_close_frame()
+    expected = expected_mas(df)
+    # Keep NaN as NaN, like parquet-loaded data
+    result = add_sma_columns(pl.from_pandas(df, nan_to_null=False).lazy()).collect()
+    for name in MA_COLUMNS:
+        np.testing.assert_allclose(result[name].to_numpy(), expected[name], equal_nan=True)
+
+
+if __name__ == "__main__":
+    test_rolling_means_numba()
+    test_rolling_means_pandas()
+    test_add_sma_columns_polars()
+    print("All SMA checks passed")
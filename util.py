@@ -1,93 +1,125 @@
 import os
 import glob
+import threading
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from datetime import datetime, timedelta
 from typing import Optional
 
 
 def remove_old_cache(folder: str, older_than_days: int = 1):
     """
-    Remove cache files older than specified days based on timestamp in filename.
+    Remove cache files (and leftover .tmp files) last modified more than specified days ago.
 
     Args:
         folder: Cache folder path
-        older_than_days: Remove files with timestamp older than this many days (default: 1)
+        older_than_days: Remove files modified longer ago than this many days (default: 1)
     """
     if not os.path.exists(folder):
         return
 
     now = datetime.now()
-    threshold = now - timedelta(days=older_than_days)
+    threshold = (now - timedelta(days=older_than_days)).timestamp()
 
-    for filename in os.listdir(folder):
-        if not filename.endswith('.parquet'):
-            continue
+    removed = []
+    with os.scandir(folder) as it:
+        for entry in it:
+            if not entry.name.endswith(('.parquet', '.tmp')):
+                continue
 
-        # Extract timestamp from filename pattern: {symbol}_{ticker}-{year}.{ts}.parquet
-        parts = filename.rsplit('.', 2)  # Split from right: [base, ts, 'parquet']
-        if len(parts) >= 3:
             try:
-                ts = int(parts[-2])
-                file_time = datetime.fromtimestamp(ts)
-                if file_time < threshold:
-                    file_path = os.path.join(folder, filename)
-                    os.remove(file_path)
-                    print(f"Removed old cache: {filename}")
-            except (ValueError, OSError):
+                if entry.stat().st_mtime < threshold:
+                    os.remove(entry.path)
+                    removed.append(entry.name)
+            except OSError:
                 continue
 
+    if removed:
+        print(f"Removed {len(removed)} stale caches from: {folder}")
+
 BASE_DIR = os.getenv('TRADE_DATA', "/trade_data")
 
+KLINE_NUMERIC_COLUMNS = ['Open', 'High', 'Low', 'Close', 'qty', 'qty_usd', 'buyer_qty', 'seller_qty',
+                         'avg_price', 'buyer_avg_price', 'seller_avg_price']
+
+
+def write_cache_file(cache_file: str, write) -> None:
+    """
+    Write a cache file through a temp file renamed into place, so readers never see a partial file.
+
+    The temp name is unique per process and thread, so concurrent writers of the same
+    cache key do not clobber each other; the last rename wins.
+
+    Args:
+        cache_file: Final cache file path
+        write: Callable taking the temp file path and writing the data to it
+    """
+    tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp_file)
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def parquet_dataset(files: list) -> ds.Dataset:
+    """
+    Open parquet files as one dataset with the union of all file schemas.
+
+    ds.dataset alone takes the schema of the first file and drops columns that only
+    appear in later files; those rows get nulls for columns they lack.
+
+    Args:
+        files: Parquet file paths
+
+    Returns:
+        pyarrow Dataset
+    """
+    schema = pa.unify_schemas([pq.read_schema(f) for f in files])
+    return ds.dataset(files, schema=schema, format="parquet")
+
+
 def find_latest_file(file_pattern):
     """
     Find the latest file based on end date in filename.
-    
+
+    End dates are zero-padded (YYYYMMDD or YYYY-MM-DD), so with dashes removed their
+    string order is their date order and no date parsing is needed.
+
     Args:
         file_pattern: Glob pattern to match files
-        dir_path: Directory path for error messages
-    
+
     Returns:
         Path to the latest file
     """
     # Find all matching files
     matching_files = glob.glob(file_pattern)
-    
+
     if not matching_files:
         raise FileNotFoundError(f"No files found matching pattern: {file_pattern}")
-    
-    latest_file = None
-    latest_end_date = None
-    
-    for file_path in matching_files:
-        filename = os.path.basename(file_path)
-        parts = filename.replace('.parquet', '').split('_')
-        
-        if len(parts) >= 4:
-            end_date_str = parts[-1]
-            
-            try:
-                if len(end_date_str) == 8:  # YYYYMMDD format
-                    end_date = datetime.strptime(end_date_str, '%Y%m%d')
-                elif len(end_date_str) == 10:  # YYYY-MM-DD format
-                    end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-                else:
-                    end_date = datetime.fromisoformat(end_date_str.replace('_', '-'))
-                
-                if latest_end_date is None or end_date > latest_end_date:
-                    latest_end_date = end_date
-                    latest_file = file_path
-                    
-            except ValueError:
-                continue
-    
-    if latest_file is None:
+
+    def end_date_key(file_path):
+        parts = os.path.basename(file_path).replace('.parquet', '').split('_')
+        if len(parts) < 4:
+            return ''
+        end_date = parts[-1].replace('-', '')
+        return end_date if len(end_date) == 8 and end_date.isdigit() else ''
+
+    latest_file = max(matching_files, key=end_date_key)
+
+    if not end_date_key(latest_file):
         raise FileNotFoundError(f"Could not find valid data files in: {file_pattern}")
-    
+
     return latest_file
 
 def load_parquet(source: str = "binance", market: str = "future", market_sub: str = "um",
               data_type: str = "kline", symbol: str = None, detail: str = None,
-              years: list = None) -> pd.DataFrame:
+              years: list = None, columns: Optional[list] = None) -> pd.DataFrame:
     """
     Load parquet data from structured directory path.
 
@@ -99,9 +131,10 @@ def load_parquet(source: str = "binance", market: str = "future", market_sub: st
         symbol: Trading symbol (e.g., "BTCUSDT")
         detail: Timeframe detail (e.g., "1d", "1h", "1m")
         years: List of years to load for aggTrades (e.g., [2024, 2025]). If None, load all files.
+        columns: List of columns to read (as named in the file). None reads all columns.
 
     Returns:
-        DataFrame containing the loaded data
+        DataFrame containing the loaded data (a timezone-aware time column is converted to naive UTC)
     """
 
     if symbol is None:
@@ -142,18 +175,11 @@ def load_parquet(source: str = "binance", market: str = "future", market_sub: st
         matching_files.sort()
 
         try:
-            dfs = []
-            for file_path in matching_files:
-                df = pd.read_parquet(file_path)
-                print(f"Loaded data from: {file_path}, shape: {df.shape}")
-                dfs.append(df)
-
-            # Combine all dataframes
-            if len(dfs) == 1:
-                df = dfs[0]
-            else:
-                df = pd.concat(dfs, ignore_index=True)
-                print(f"Combined {len(dfs)} files, total shape: {df.shape}")
+            # Scan all files as one dataset, reading only the requested columns
+            dset = parquet_dataset(matching_files)
+            df = dset.to_table(columns=columns).to_pandas(self_destruct=True, split_blocks=True)
+            normalize_time(df)
+            print(f"Loaded {len(matching_files)} files from: {dir_path}, total shape: {df.shape}")
 
             return df
         except Exception as e:
@@ -171,14 +197,14 @@ def load_parquet(source: str = "binance", market: str = "future", market_sub: st
 
     # Load the latest file
     try:
-        df = pd.read_parquet(latest_file)
+        df = pd.read_parquet(latest_file, columns=columns)
         print(f"Loaded data from: {latest_file}")
         print(f"Data shape: {df.shape}")
 
         required_cols = ['Open', 'High', 'Low', 'Close', 'Volume']
         rename_dict = {col: col.capitalize() for col in df.columns if col.lower() in ['open', 'high', 'low', 'close', 'volume']}
         df = df.rename(columns=rename_dict)
-        return df
+        return normalize_time(df)
     except Exception as e:
         raise RuntimeError(f"Error loading parquet file {latest_file}: {str(e)}")
     
@@ -233,8 +259,160 @@ def show_all_rows(df: pd.DataFrame):
         display(df)
 
 
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Downcast kline numeric columns to float32 and symbol to category, in place.
+
+    Args:
+        df: Kline DataFrame (missing columns are skipped)
+
+    Returns:
+        The same DataFrame
+    """
+    num_cols = [c for c in KLINE_NUMERIC_COLUMNS if c in df.columns]
+    if num_cols:
+        df[num_cols] = df[num_cols].astype('float32', copy=False)
+    if 'symbol' in df.columns:
+        df['symbol'] = df['symbol'].astype('category')
+    return df
+
+
+def normalize_time(df: pd.DataFrame, time_col: str = 'time') -> pd.DataFrame:
+    """
+    Convert a timezone-aware time column to timezone-naive UTC, in place.
+
+    Args:
+        df: DataFrame with a time column (no-op if missing or not timezone-aware)
+        time_col: Name of the time column (default: 'time')
+
+    Returns:
+        The same DataFrame
+    """
+    if time_col in df.columns and isinstance(df[time_col].dtype, pd.DatetimeTZDtype):
+        df[time_col] = df[time_col].dt.tz_convert('UTC').dt.tz_localize(None)
+    return df
+
+
+def kline_dir(source: str = "binance", market: str = "spot", market_sub: str = "um") -> str:
+    """
+    Get the aggTrades_kline directory path.
+
+    Args:
+        source: Data source (default: "binance")
+        market: Market type - "spot" or "future" (default: "spot")
+        market_sub: Market subtype for futures - "um" or "cm" (default: "um")
+
+    Returns:
+        Directory path (not checked for existence)
+    """
+    if market == "spot":
+        return os.path.join(BASE_DIR, source, market, "aggTrades_kline")
+    else:  # future
+        return os.path.join(BASE_DIR, source, market, market_sub, "aggTrades_kline")
+
+
+def find_kline_files(dir_path: str, symbol: str, timeframe: str, years: Optional[list] = None) -> list:
+    """
+    Find the kline files of one symbol, filtered by years.
+
+    Args:
+        dir_path: aggTrades_kline directory path
+        symbol: Trading symbol (e.g., "BTCUSDT")
+        timeframe: Timeframe (e.g., "1m")
+        years: List of years to load. None loads all years.
+
+    Returns:
+        Sorted list of file paths, empty if none were found
+    """
+    symbol_dir = os.path.join(dir_path, symbol)
+    if not os.path.exists(symbol_dir):
+        print(f"Warning: Symbol directory not found: {symbol_dir}")
+        return []
+
+    # Find matching files for this symbol
+    file_pattern = os.path.join(symbol_dir, f"{symbol}_kline_{timeframe}_*.parquet")
+    matching_files = glob.glob(file_pattern)
+
+    if not matching_files:
+        print(f"Warning: No files found for {symbol} with timeframe {timeframe}")
+        return []
+
+    # Filter by years if specified
+    if years is not None:
+        # Match pattern like "{symbol}_kline_1m_2025.parquet" or "{symbol}_kline_1m_2026-01-23.parquet":
+        # the year is the first 4 chars after the prefix, followed by "." or "-"
+        years_set = {str(y) for y in years}
+        prefix_len = len(f"{symbol}_kline_{timeframe}_")
+        filtered_files = []
+        for f in matching_files:
+            tail = os.path.basename(f)[prefix_len:]
+            if tail[:4] in years_set and tail[4:5] in ('.', '-'):
+                filtered_files.append(f)
+        matching_files = filtered_files
+
+    if not matching_files:
+        print(f"Warning: No files found for {symbol} with years {years}")
+        return []
+
+    # Sort files so rows come out in time order
+    matching_files.sort()
+    return matching_files
+
+
+def kline_cache_file(cache_dir: str, symbol: str, timeframe: str, years: Optional[list] = None) -> str:
+    """
+    Get the cache file path of one symbol's kline data.
+
+    Pattern: {cache_dir}/{symbol}_{timeframe}-{years}.parquet (years joined by "_", or "all")
+
+    Args:
+        cache_dir: Cache folder path
+        symbol: Trading symbol (e.g., "BTCUSDT")
+        timeframe: Timeframe (e.g., "1m")
+        years: List of years loaded. None means all years.
+
+    Returns:
+        Cache file path
+    """
+    years_for_cache = years if years is not None else ["all"]
+    return os.path.join(cache_dir, f"{symbol}_{timeframe}-{'_'.join(map(str, years_for_cache))}.parquet")
+
+
+def _load_kline_symbol(dir_path: str, symbol: str, timeframe: str, years: Optional[list],
+                       cache_file: str) -> Optional[pa.Table]:
+    """
+    Load all kline files of one symbol from source and write them to cache.
+
+    Args:
+        dir_path: aggTrades_kline directory path
+        symbol: Trading symbol (e.g., "BTCUSDT")
+        timeframe: Timeframe (e.g., "1m")
+        years: List of years to load. None loads all years.
+        cache_file: Cache file path to write
+
+    Returns:
+        Arrow Table with all columns, or None if no matching files were found
+    """
+    matching_files = find_kline_files(dir_path, symbol, timeframe, years)
+    if not matching_files:
+        return None
+
+    # Load files as one dataset (all columns, since the cache keeps them all)
+    dset = parquet_dataset(matching_files)
+    symbol_table = dset.to_table()
+    print(f"Loaded {len(matching_files)} files for {symbol}, shape: {symbol_table.shape}")
+
+    # Save to cache
+    write_cache_file(cache_file, lambda path: pq.write_table(symbol_table, path, compression='snappy'))
+    print(f"Cached: {cache_file}, shape: {symbol_table.shape}")
+
+    return symbol_table
+
+
 def load_kline(source: str = "binance", market: str = "spot", market_sub: str = "um",
-               timeframe: str = "1m", years: Optional[list] = None, symbols: Optional[list] = None) -> pd.DataFrame:
+               timeframe: str = "1m", years: Optional[list] = None, symbols: Optional[list] = None,
+               columns: Optional[list] = None, max_workers: Optional[int] = None,
+               dtypes: Optional[str] = None, return_format: str = "frame"):
     """
     Load kline data from aggTrades_kline directory (per-symbol structure).
 
@@ -248,13 +426,25 @@ def load_kline(source: str = "binance", market: str = "spot", market_sub: str =
         market_sub: Market subtype for futures - "um" or "cm" (default: "um")
         timeframe: Timeframe - 1m, 3m, 5m, 15m, 30m, 1h, 4h, 8h, 12h, 1d (default: "1m")
         years: List of years to load (e.g., [2024, 2025]). None loads all years.
-        symbols: List of symbols to load (e.g., ["BTCUSDT", "ETHUSDT"]). Required.
+        symbols: List of symbols to load (e.g., ["BTCUSDT", "ETHUSDT"]). Required; duplicates are ignored.
+        columns: List of columns to return (e.g., ["Close"]). symbol and time are always
+                 included. None returns all columns. Cache files always keep all columns.
+        max_workers: Number of threads loading symbols from source in parallel.
+                     None uses min(16, number of symbols without cache).
+        dtypes: "compact" downcasts numeric columns to float32 and symbol to category
+                (about half the memory). None keeps the stored dtypes.
+        return_format: "frame" returns one concatenated DataFrame. "dict" returns
+                       {symbol: DataFrame} in symbol order without concatenating.
 
     Returns:
-        DataFrame containing the kline data with columns:
+        DataFrame (or dict of per-symbol DataFrames) sorted by symbol, time (timezone-naive UTC)
+        containing the kline data with columns:
         symbol, time, Open, High, Low, Close, qty, qty_usd, buyer_qty, seller_qty,
         avg_price, buyer_avg_price, seller_avg_price
 
+        Rows within each source file must be time-ascending (as written by the kline
+        builder); files are ordered by the year/date in their name.
+
     Example:
         # Load 1m data for 2025, specific symbols
         df = load_kline(market="spot", timeframe="1m", years=[2025], symbols=["AAVEUSDT", "ADAUSDT"])
@@ -269,11 +459,22 @@ def load_kline(source: str = "binance", market: str = "spot", market_sub: str =
     if symbols is None or len(symbols) == 0:
         raise ValueError("symbols parameter is required and cannot be empty")
 
+    if dtypes not in (None, "compact"):
+        raise ValueError(f"Invalid dtypes '{dtypes}'. Valid options: None, 'compact'")
+
+    if return_format not in ("frame", "dict"):
+        raise ValueError(f"Invalid return_format '{return_format}'. Valid options: 'frame', 'dict'")
+
+    # Symbols are loaded in sorted order and each symbol's files are time-ascending,
+    # so the combined frame comes out sorted by symbol, time without a sort pass
+    symbols = sorted(set(symbols))
+
+    # symbol and time are always returned, keep them first
+    if columns is not None:
+        columns = ['symbol', 'time'] + [c for c in columns if c not in ('symbol', 'time')]
+
     # Construct directory path
-    if market == "spot":
-        dir_path = os.path.join(BASE_DIR, source, market, "aggTrades_kline")
-    else:  # future
-        dir_path = os.path.join(BASE_DIR, source, market, market_sub, "aggTrades_kline")
+    dir_path = kline_dir(source, market, market_sub)
 
     if not os.path.exists(dir_path):
         raise FileNotFoundError(f"Directory not found: {dir_path}")
@@ -286,104 +487,68 @@ def load_kline(source: str = "binance", market: str = "spot", market_sub: str =
     # Remove old cache files
     remove_old_cache(cache_dir, older_than_days=1)
 
-    # Determine years for cache naming
-    years_for_cache = years if years is not None else ["all"]
-
-    # Try to load from cache first
-    cached_dfs = []
-    all_cached = True
-    ts = int(datetime.now().timestamp())
+    # Try to load from cache first, every symbol without a cache file is loaded from source
+    cached_tables = {}
 
     for symbol in symbols:
-        cache_pattern = os.path.join(cache_dir, f"{symbol}_{timeframe}-{'_'.join(map(str, years_for_cache))}.*.parquet")
-        cached_files = glob.glob(cache_pattern)
-
-        if cached_files:
-            cached_files.sort(reverse=True)
-            cached_file = cached_files[0]
-            df_cached = pd.read_parquet(cached_file)
-            print(f"Cache hit: {cached_file}, shape: {df_cached.shape}")
-            cached_dfs.append(df_cached)
-        else:
-            all_cached = False
-            break
+        cached_file = kline_cache_file(cache_dir, symbol, timeframe, years)
 
-    if all_cached:
-        if len(cached_dfs) == 1:
-            df = cached_dfs[0]
-        else:
-            df = pd.concat(cached_dfs, ignore_index=True)
-        df = df.sort_values(['symbol', 'time']).reset_index(drop=True)
-        print(f"All {len(symbols)} symbols loaded from cache, total shape: {df.shape}")
-        return df
+        if os.path.exists(cached_file):
+            # Memory-map warm cache files, snappy pages decode straight from the page cache
+            table_cached = pq.read_table(cached_file, columns=columns, memory_map=True)
+            print(f"Cache hit: {cached_file}, shape: {table_cached.shape}")
+            cached_tables[symbol] = table_cached
+
+    missing = [symbol for symbol in symbols if symbol not in cached_tables]
 
     # Load from source files
     try:
-        all_dfs = []
-
-        for symbol in symbols:
-            symbol_dir = os.path.join(dir_path, symbol)
-            if not os.path.exists(symbol_dir):
-                print(f"Warning: Symbol directory not found: {symbol_dir}")
-                continue
-
-            # Find matching files for this symbol
-            file_pattern = os.path.join(symbol_dir, f"{symbol}_kline_{timeframe}_*.parquet")
-            matching_files = glob.glob(file_pattern)
-
-            if not matching_files:
-                print(f"Warning: No files found for {symbol} with timeframe {timeframe}")
-                continue
-
-            # Filter by years if specified
-            if years is not None:
-                years_str = [str(y) for y in years]
-                filtered_files = []
-                for f in matching_files:
-                    filename = os.path.basename(f)
-                    # Match pattern like "{symbol}_kline_1m_2025.parquet" or "{symbol}_kline_1m_2026-01-23.parquet"
-                    if any(f"_{year}." in filename or f"_{year}-" in filename for year in years_str):
-                        filtered_files.append(f)
-                matching_files = filtered_files
-
-            if not matching_files:
-                print(f"Warning: No files found for {symbol} with years {years}")
-                continue
-
-            # Sort and load files
-            matching_files.sort()
-            symbol_dfs = []
-
-            for file_path in matching_files:
-                df = pd.read_parquet(file_path)
-                print(f"Loaded: {file_path}, shape: {df.shape}")
-                symbol_dfs.append(df)
-
-            if symbol_dfs:
-                if len(symbol_dfs) == 1:
-                    symbol_df = symbol_dfs[0]
-                else:
-                    symbol_df = pd.concat(symbol_dfs, ignore_index=True)
-
-                # Save to cache
-                cache_file = os.path.join(cache_dir, f"{symbol}_{timeframe}-{'_'.join(map(str, years_for_cache))}.{ts}.parquet")
-                symbol_df.to_parquet(cache_file, index=False)
-                print(f"Cached: {cache_file}, shape: {symbol_df.shape}")
-
-                all_dfs.append(symbol_df)
-
-        if not all_dfs:
+        loaded_tables = {}
+
+        def load_symbol(symbol):
+            cache_file = kline_cache_file(cache_dir, symbol, timeframe, years)
+            return _load_kline_symbol(dir_path, symbol, timeframe, years, cache_file)
+
+        if missing:
+            # Each symbol is an independent I/O-bound read, arrow releases the GIL while decoding
+            if max_workers is None:
+                max_workers = min(16, len(missing))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                symbol_tables = list(executor.map(load_symbol, missing))
+
+            for symbol, symbol_table in zip(missing, symbol_tables):
+                if symbol_table is None:
+                    continue
+                if columns is not None:
+                    symbol_table = symbol_table.select(columns)
+                loaded_tables[symbol] = symbol_table
+
+        # Merge in symbol order so the result stays sorted by symbol, time
+        all_tables = {symbol: cached_tables[symbol] if symbol in cached_tables else loaded_tables[symbol]
+                      for symbol in symbols if symbol in cached_tables or symbol in loaded_tables}
+
+        if not all_tables:
             raise FileNotFoundError(f"No data found for symbols {symbols}")
 
-        # Combine all symbol dataframes
-        if len(all_dfs) == 1:
-            df = all_dfs[0]
+        if return_format == "dict":
+            dfs = {}
+            for symbol, symbol_table in all_tables.items():
+                symbol_df = normalize_time(symbol_table.to_pandas(self_destruct=True))
+                if dtypes == "compact":
+                    compact_dtypes(symbol_df)
+                dfs[symbol] = symbol_df
+            print(f"Loaded {len(dfs)} symbols ({len(cached_tables)} from cache)")
+            return dfs
+
+        # Combine all symbol tables without copying, then convert to pandas once
+        df = pa.concat_tables(list(all_tables.values()), promote_options="default").to_pandas(self_destruct=True)
+        normalize_time(df)
+        if missing:
+            print(f"Combined {len(cached_tables)} cached and {len(loaded_tables)} loaded symbols, total shape: {df.shape}")
         else:
-            df = pd.concat(all_dfs, ignore_index=True)
-            print(f"Combined {len(all_dfs)} symbols, total shape: {df.shape}")
-
-        # Sort by symbol and time
-        df = df.sort_values(['symbol', 'time']).reset_index(drop=True)
+            print(f"All {len(symbols)} symbols loaded from cache, total shape: {df.shape}")
+        if dtypes == "compact":
+            compact_dtypes(df)
 
         return df
 
@@ -408,19 +573,16 @@ def load_kline_symbols(source: str = "binance", market: str = "spot", market_sub
         print(f"Found {len(symbols)} symbols")
     """
     # Construct directory path
-    if market == "spot":
-        dir_path = os.path.join(BASE_DIR, source, market, "aggTrades_kline")
-    else:  # future
-        dir_path = os.path.join(BASE_DIR, source, market, market_sub, "aggTrades_kline")
+    dir_path = kline_dir(source, market, market_sub)
 
     if not os.path.exists(dir_path):
         raise FileNotFoundError(f"Directory not found: {dir_path}")
 
     # Get all subdirectories (each is a symbol), excluding _cache
-    symbols = [d for d in os.listdir(dir_path)
-               if os.path.isdir(os.path.join(dir_path, d)) and d != '_cache']
+    with os.scandir(dir_path) as it:
+        symbols = sorted(e.name for e in it if e.is_dir() and e.name != '_cache')
 
-    return sorted(symbols)
+    return symbols
 
 
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from sma import SMA_WINDOWS, rolling_means
 
 
 def plot_ohlcv(df, time_col='time', go_to_time=None, ticker='1m', symbol=None,
@@ -10,7 +12,8 @@ def plot_ohlcv(df, time_col='time', go_to_time=None, ticker='1m', symbol=None,
     Auto-rescales Y-axis when panning.
 
     Parameters:
-    - df: DataFrame with OHLCV data (must have: time, Open, High, Low, Close, and optionally volume columns)
+    - df: DataFrame with OHLCV data (must have: time, Open, High, Low, Close, and optionally volume columns).
+      The time column must be timezone-naive UTC, as returned by util.load_kline.
     - time_col: Name of the time column (default: 'time')
     - go_to_time: str like '2025-12-30' or '2025-12-19 09:26:00' to center the view
     - ticker: Timeframe string for calculating time deltas ('1m', '1h', '1d', etc.)
@@ -36,12 +39,9 @@ def plot_ohlcv(df, time_col='time', go_to_time=None, ticker='1m', symbol=None,
     }
     td = ticker_map.get(ticker, pd.Timedelta(minutes=1))
 
-    # Prepare dataframe with standardized column names
-    df_plot = df.copy()
-
-    # Standardize column names (lowercase)
-    col_map = {}
-    for col in df_plot.columns:
+    # Standardize column names (lowercase OHLCV, 'time', uppercase MAs)
+    col_map = {time_col: 'time'}
+    for col in df.columns:
         if col.lower() == 'open':
             col_map[col] = 'open'
         elif col.lower() == 'high':
@@ -52,43 +52,26 @@ def plot_ohlcv(df, time_col='time', go_to_time=None, ticker='1m', symbol=None,
             col_map[col] = 'close'
         elif col.lower() in ['volume', 'qty', 'quantity']:
             col_map[col] = 'volume'
-    df_plot = df_plot.rename(columns=col_map)
-
-    # Ensure time column is named 'time'
-    if time_col != 'time' and time_col in df_plot.columns:
-        df_plot = df_plot.rename(columns={time_col: 'time'})
-
-    # Calculate MAs if not present
-    if 'ma7' not in df_plot.columns and 'MA7' not in df_plot.columns:
-        df_plot['ma7'] = df_plot['close'].rolling(window=7, min_periods=1).mean()
-    if 'ma25' not in df_plot.columns and 'MA25' not in df_plot.columns:
-        df_plot['ma25'] = df_plot['close'].rolling(window=25, min_periods=1).mean()
-    if 'ma99' not in df_plot.columns and 'MA99' not in df_plot.columns:
-        df_plot['ma99'] = df_plot['close'].rolling(window=99, min_periods=1).mean()
-
-    # Standardize MA column names
-    ma_cols = {}
-    for col in df_plot.columns:
-        if col.lower() == 'ma7':
-            ma_cols[col] = 'MA7'
+        elif col.lower() == 'ma7':
+            col_map[col] = 'MA7'
         elif col.lower() == 'ma25':
-            ma_cols[col] = 'MA25'
+            col_map[col] = 'MA25'
         elif col.lower() == 'ma99':
-            ma_cols[col] = 'MA99'
-    df_plot = df_plot.rename(columns=ma_cols)
+            col_map[col] = 'MA99'
 
-    # Ensure time column is timezone-naive for consistent comparison
-    if df_plot['time'].dt.tz is not None:
-        df_plot['time'] = df_plot['time'].dt.tz_localize(None)
+    times = df[time_col]
+    if isinstance(times.dtype, pd.DatetimeTZDtype):
+        raise ValueError(f"Time column '{time_col}' is timezone-aware ({times.dt.tz}); "
+                         f"convert it to naive UTC first, e.g. util.normalize_time(df, '{time_col}')")
 
     # Set center time
     if go_to_time is None:
-        center_time = df_plot['time'].max()
+        center_time = times.max()
     else:
         center_time = pd.to_datetime(go_to_time)
-        # Ensure center_time is also timezone-naive
-        if hasattr(center_time, 'tz') and center_time.tz is not None:
-            center_time = center_time.tz_localize(None)
+        # Compare in timezone-naive UTC like the time column
+        if center_time.tz is not None:
+            center_time = center_time.tz_convert('UTC').tz_localize(None)
 
     # Data range (larger - for panning)
     data_start = center_time - (td * data_bars)
@@ -98,12 +81,20 @@ def plot_ohlcv(df, time_col='time', go_to_time=None, ticker='1m', symbol=None,
     view_start = center_time - (td * show_bars)
     view_end = center_time + (td * show_bars)
 
-    # Filter data
-    df_view = df_plot[(df_plot['time'] >= data_start) & (df_plot['time'] <= data_end)].copy()
+    # Filter data before copying
+    mask = (times >= data_start) & (times <= data_end)
+    df_view = df.loc[mask, list(col_map)].rename(columns=col_map)
     if len(df_view) == 0:
         print(f"No data found around {go_to_time}")
         return None
 
+    # Calculate MAs if not present (over the loaded window only, all windows in one pass)
+    missing = [(row, f'MA{window}') for row, window in enumerate(SMA_WINDOWS) if f'MA{window}' not in df_view.columns]
+    if missing:
+        mas = rolling_means(df_view['close'].to_numpy())
+        for row, name in missing:
+            df_view[name] = mas[row]
+
     # Calculate y-axis range based on visible area only
     df_visible = df_view[(df_view['time'] >= view_start) & (df_view['time'] <= view_end)]
     if len(df_visible) == 0:
@@ -123,14 +114,19 @@ def plot_ohlcv(df, time_col='time', go_to_time=None, ticker='1m', symbol=None,
         row_heights=[0.7, 0.3]
     )
 
+    # Extract plain arrays once, plotly takes them without per-column pandas conversion
+    x = df_view['time'].to_numpy()
+    open_ = df_view['open'].to_numpy()
+    close = df_view['close'].to_numpy()
+
     # Candlestick chart
     fig.add_trace(
         go.Candlestick(
-            x=df_view['time'],
-            open=df_view['open'],
-            high=df_view['high'],
-            low=df_view['low'],
-            close=df_view['close'],
+            x=x,
+            open=open_,
+            high=df_view['high'].to_numpy(),
+            low=df_view['low'].to_numpy(),
+            close=close,
             name='OHLC'
         ),
         row=1, col=1
@@ -139,7 +135,7 @@ def plot_ohlcv(df, time_col='time', go_to_time=None, ticker='1m', symbol=None,
     # MA7 - Yellow
     if 'MA7' in df_view.columns:
         fig.add_trace(
-            go.Scatter(x=df_view['time'], y=df_view['MA7'], mode='lines', name='MA7',
+            go.Scatter(x=x, y=df_view['MA7'].to_numpy(), mode='lines', name='MA7',
                        line=dict(color='yellow', width=1)),
             row=1, col=1
         )
@@ -147,7 +143,7 @@ def plot_ohlcv(df, time_col='time', go_to_time=None, ticker='1m', symbol=None,
     # MA25 - Purple
     if 'MA25' in df_view.columns:
         fig.add_trace(
-            go.Scatter(x=df_view['time'], y=df_view['MA25'], mode='lines', name='MA25',
+            go.Scatter(x=x, y=df_view['MA25'].to_numpy(), mode='lines', name='MA25',
                        line=dict(color='purple', width=1)),
             row=1, col=1
         )
@@ -155,17 +151,16 @@ def plot_ohlcv(df, time_col='time', go_to_time=None, ticker='1m', symbol=None,
     # MA99 - Teal
     if 'MA99' in df_view.columns:
         fig.add_trace(
-            go.Scatter(x=df_view['time'], y=df_view['MA99'], mode='lines', name='MA99',
+            go.Scatter(x=x, y=df_view['MA99'].to_numpy(), mode='lines', name='MA99',
                        line=dict(color='rgb(40, 86, 89)', width=1)),
             row=1, col=1
         )
 
     # Volume bars
     if 'volume' in df_view.columns:
-        colors = ['green' if close >= open else 'red'
-                  for close, open in zip(df_view['close'], df_view['open'])]
+        colors = np.where(close >= open_, 'green', 'red').tolist()
         fig.add_trace(
-            go.Bar(x=df_view['time'], y=df_view['volume'], name='Volume', marker_color=colors),
+            go.Bar(x=x, y=df_view['volume'].to_numpy(), name='Volume', marker_color=colors),
             row=2, col=1
         )
 